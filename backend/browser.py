@@ -1,18 +1,29 @@
 import asyncio
+import functools
+import glob
+import itertools
 import json
 import logging
+import re
 import subprocess
 import sys
 import os
 import uuid
 import time
-from typing import Callable, Dict, Optional, Any
+from typing import Callable, Dict, List, Optional, Any, Tuple, Pattern
+from urllib.parse import urlparse
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Request, Response
 
+try:
+    import orjson  # Optional, faster JSON parsing
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 logger = logging.getLogger(__name__)
 
-def ensure_browser_installed():
-    """Check if Playwright browser is installed, download if not."""
+def ensure_browser_installed() -> bool:
+    """Check if Playwright browser is installed, download if not. Returns whether it is available."""
     print("=" * 50)
     print("Chameleon - Initializing...")
     print("=" * 50)
@@ -25,28 +36,21 @@ def ensure_browser_installed():
     os.environ["PLAYWRIGHT_BROWSERS_PATH"] = ms_pw_path
     
     # Check if browser exists
-    browser_exists = False
-    if os.path.exists(ms_pw_path):
-        for d in os.listdir(ms_pw_path):
-            if 'chromium' in d.lower() and os.path.isdir(os.path.join(ms_pw_path, d)):
-                chromium_path = os.path.join(ms_pw_path, d)
-                # Check if chrome.exe exists
-                for root, dirs, files in os.walk(chromium_path):
-                    if 'chrome.exe' in files:
-                        browser_exists = True
-                        print(f"[OK] Browser found at: {chromium_path}")
-                        break
-                if browser_exists:
-                    break
+    # Playwright lays Chromium out as chromium-<rev>/chrome-win*/chrome.exe, so look there
+    # directly instead of walking the thousands of files in the install
+    # (the install path is escaped: a '[' or ']' in the profile path is not a glob character class)
+    chrome_exe = next(glob.iglob(os.path.join(glob.escape(ms_pw_path), "chromium-*", "chrome-*", "chrome.exe")), None)
     
-    if browser_exists:
+    if chrome_exe:
+        print(f"[OK] Browser found at: {os.path.dirname(os.path.dirname(chrome_exe))}")
         print()
-        return
+        return True
     
     print("[!] Browser not found. Downloading Chromium...")
     print("    This is a one-time download (~150MB), please wait...")
     print()
     
+    installed = False
     try:
         # Use npx playwright or find playwright executable
         # First try using the playwright package directly
@@ -60,29 +64,135 @@ def ensure_browser_installed():
                 capture_output=False,
                 env={**os.environ, "PLAYWRIGHT_BROWSERS_PATH": ms_pw_path}
             )
-            if result.returncode == 0:
+            installed = result.returncode == 0
+            if installed:
                 print()
                 print("[OK] Browser download complete!")
             else:
                 print("[!] Browser download may have issues...")
         else:
             # Fallback: try npx
-            subprocess.run(
+            result = subprocess.run(
                 ["npx", "playwright", "install", "chromium"],
                 capture_output=False,
                 shell=True,
                 env={**os.environ, "PLAYWRIGHT_BROWSERS_PATH": ms_pw_path}
             )
+            installed = result.returncode == 0
     except Exception as e:
         print(f"[!] Error: {e}")
         print("    Please run manually: npx playwright install chromium")
     
     print()
-
-# Auto-download browser on import
-ensure_browser_installed()
+    return installed
+
+@functools.lru_cache(maxsize=256)
+def _origin_of(url: str) -> str:
+    """scheme://netloc of a URL (memoized, Repeater replays hit the same URLs repeatedly)"""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+# Resource types whose bodies are not captured as text unless response interception or body rules need them
+_BINARY_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+# ...except these content types, which are text despite the resource type (and shown in the history view)
+_TEXT_CONTENT_TYPES = ("image/svg+xml",)
+
+# Routed requests after which the browser context is recycled to release Playwright's per-request objects.
+# Off by default (0): recycling replaces the window the user works in, losing sessionStorage, history and
+# in-page state. Set CHAMELEON_CONTEXT_RECYCLE_REQUESTS (e.g. 20000) for long unattended capture sessions.
+CONTEXT_RECYCLE_REQUESTS = int(os.environ.get("CHAMELEON_CONTEXT_RECYCLE_REQUESTS", "0"))
+
+# Headers typically forbidden in window.fetch, sent via the override header instead
+_FORBIDDEN_FETCH_HEADERS = frozenset({
+    "host", "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "cookie", "user-agent", "referer", "origin", "content-length", "date", "expect"
+})
+
+# Internal Repeater control headers, stripped before a request leaves the browser
+_CONTROL_HEADERS = frozenset({"x-waf-bypass-repeater", "x-antigravity-override"})
+
+# Headers Playwright computes itself on route.continue_()
+_CONTINUE_STRIPPED_HEADERS = frozenset({"host", "content-length"})
+
+# Seconds a Repeater replay may take before it is aborted
+REPLAY_TIMEOUT = 30
+
+def _decode_body(body: Optional[bytes]) -> Optional[str]:
+    """Decode a body as UTF-8 text for display, None if it isn't text"""
+    if body is None:
+        return None
+    try:
+        return body.decode()
+    except UnicodeDecodeError:
+        return None
+
+def _compile_rule(rule) -> Optional[Pattern]:
+    """Compile a regex rule's pattern once, so the hot path never re-parses it."""
+    if not rule.isRegex:
+        return None
+    return re.compile(rule.match)
+
+def _substitute(rule, pattern: Optional[Pattern], text: str) -> str:
+    """Apply a single match/replace rule to text"""
+    if pattern is None:
+        return text.replace(rule.match, rule.replace)
+    try:
+        return pattern.sub(rule.replace, text)
+    except re.error:
+        return text
+
+def _run_rules(rules: List[Tuple[Any, Optional[Pattern]]], text: str) -> str:
+    """Apply rules in order"""
+    for rule, pattern in rules:
+        text = _substitute(rule, pattern, text)
+    return text
+
+def _is_part_local(rule, pattern: Optional[Pattern]) -> bool:
+    """
+    Whether a header rule can only ever match inside the name or inside the value.
+    A literal without ':' that doesn't start with whitespace can't span the ': '
+    separator, and a replacement without ':' can't move it, so (as long as the name
+    itself has no ':') rewriting the name and value separately gives the same result
+    as rewriting the 'Name: Value' line.
+    Regex rules are never treated as local, since e.g. '.' or '[^;]' match the separator.
+    """
+    return (pattern is None and bool(rule.match) and ':' not in rule.match
+            and not rule.match[0].isspace() and ':' not in rule.replace)
+
+def _rewrite_header(rules: List[Tuple[Any, Optional[Pattern], bool]], k: str, v: str) -> Optional[Tuple[str, str]]:
+    """
+    Apply header rules in order to one header.
+    Returns the new (name, value), or None when the header was deleted (emptied or lost its ':').
+    """
+    line = None # 'Name: Value', only built for rules that need the whole line
+    for rule, pattern, part_local in rules:
+        # (a name can only contain ':' after an earlier line rule rewrote it)
+        if part_local and ':' not in k:
+            new_k = k.replace(rule.match, rule.replace)
+            new_v = v.replace(rule.match, rule.replace)
+            if new_k is not k or new_v is not v:
+                k, v = new_k, new_v
+                line = None
+            continue
+        
+        if line is None:
+            line = f"{k}: {v}"
+        new_line = _substitute(rule, pattern, line)
+        if new_line is line:
+            continue
+        if ':' not in new_line: # If empty after replace, effectively deletes the header
+            return None
+        if ': ' not in new_line:
+            new_k, new_v = new_line.split(':', 1)
+            new_line = f"{new_k}: {new_v}"
+        k, v = new_line.split(': ', 1)
+        line = new_line
+    return k, v
 
 class BrowserManager:
+    # Shared install check, so it runs at most once per process
+    _browser_check: Optional[asyncio.Future] = None
+
     def __init__(self, on_request_captured: Callable[[Dict], None]):
         self.playwright = None
         self.browser: Optional[Browser] = None
@@ -96,11 +206,44 @@ class BrowserManager:
         self.intercept_responses = False
         self.pending_items: Dict[str, Dict[str, Any]] = {}  # id -> {route, request, event, type}
         self.match_replace_rules: List[Any] = []
+        self._rules_by_item: Dict[str, List[Tuple[Any, Optional[Pattern]]]] = {}  # item -> [(rule, compiled)]
+        self._header_rules: Dict[str, List[Tuple[Any, Optional[Pattern], bool]]] = {}  # header item -> [(rule, compiled, part_local)]
+        self._has_any_rules = False
+        self._has_body_rules = False
+        self._byte_rules: Dict[str, List[Tuple[bytes, bytes]]] = {}  # 'Response body' -> [(match, replace)] when all its rules are literal
+        
+        # Item ids: a random per-instance prefix keeps them unique across sessions
+        # (saved projects keep their ids), the counter avoids a uuid4() per item
+        self._id_prefix = uuid.uuid4().hex
+        self._id_counter = itertools.count()
+        
+        # Context recycling state
+        self._requests_since_recycle = 0
+        self._routes_in_flight = 0
+        self._replays_in_flight = 0
+        self._recycle_task: Optional[asyncio.Task] = None
+
+    async def ensure_browser(self):
+        """Make sure Chromium is installed, running the blocking check off the event loop"""
+        if BrowserManager._browser_check is None:
+            BrowserManager._browser_check = asyncio.ensure_future(asyncio.to_thread(ensure_browser_installed))
+        check = BrowserManager._browser_check
+        installed = False
+        try:
+            # Shielded: one cancelled caller must not cancel the check the others are waiting on
+            installed = await asyncio.shield(check)
+        finally:
+            # Forget a check that finished without a browser (failed download, error, cancellation),
+            # so the next call runs it again
+            if not installed and check.done() and BrowserManager._browser_check is check:
+                BrowserManager._browser_check = None
 
     async def start(self, url: str):
         if self.active:
             await self.stop()
         
+        await self.ensure_browser()
+        
         try:
             print(f"[Browser] Starting Playwright...")
             self.playwright = await async_playwright().start()
@@ -125,27 +268,80 @@ class BrowserManager:
             logger.error(f"Failed to launch browser: {e}")
             raise
         
+        self.context = await self._new_context()
+        self.page = await self.context.new_page()
+        self._requests_since_recycle = 0
+        self.active = True
+
+        try:
+            await self.page.goto(url, wait_until="domcontentloaded")
+        except Exception as e:
+            logger.error(f"Error navigating to {url}: {e}")
+
+    def _next_id(self) -> str:
+        return f"{self._id_prefix}-{next(self._id_counter)}"
+
+    async def _new_context(self, storage_state: Optional[Dict] = None) -> BrowserContext:
+        """Create a browser context with route interception installed"""
         # User Agent override can help, but default chromium one is usually okay.
         # We'll use a standard context.
         # Setting viewport to None allows the page to resize to the window size
-        self.context = await self.browser.new_context(
+        context = await self.browser.new_context(
             viewport=None,
-            ignore_https_errors=True 
+            ignore_https_errors=True,
+            storage_state=storage_state
         )
         
         # Use route interception for requests (allows pause/modify/forward)
-        await self.context.route("**/*", self._route_handler)
-        
-        # Response listener (for capturing, intercept handled in route)
-
-
-        self.page = await self.context.new_page()
-        self.active = True
-
+        await context.route("**/*", self._route_handler)
+        return context
+
+    def _context_busy(self) -> bool:
+        """Whether closing the context now would cut off something in progress"""
+        return bool(self._routes_in_flight
+                    or self.pending_items
+                    or self._replays_in_flight
+                    # Only the main page is carried over; never close tabs or popups the user opened
+                    or (self.context and len(self.context.pages) > 1))
+
+    def _should_recycle_context(self) -> bool:
+        return (self.active
+                and CONTEXT_RECYCLE_REQUESTS > 0
+                and self._requests_since_recycle >= CONTEXT_RECYCLE_REQUESTS
+                and (self._recycle_task is None or self._recycle_task.done())
+                and not self._context_busy())
+
+    async def _recycle_context(self):
+        """
+        Swap the browser context for a fresh one, carrying over cookies and localStorage.
+        Playwright keeps per-request objects alive for the lifetime of a routed context,
+        so long sessions grow without bound unless the context itself is closed.
+        """
+        old_context = self.context
+        current_url = self.page.url if self.page else None
         try:
-            await self.page.goto(url, wait_until="domcontentloaded")
+            state = await old_context.storage_state()
+            new_context = await self._new_context(storage_state=state)
+            new_page = await new_context.new_page()
+            # The old context kept working during the awaits above; back off if it picked up work
+            # (it is retried after the next routed request completes)
+            if not self.active or self.context is not old_context or self._context_busy():
+                await new_context.close()
+                return
+            self.context, self.page = new_context, new_page
+            self._requests_since_recycle = 0
+            await old_context.close()
+            logger.info("Recycled browser context")
         except Exception as e:
-            logger.error(f"Error navigating to {url}: {e}")
+            logger.error(f"Failed to recycle browser context: {e}")
+            self._requests_since_recycle = 0
+            return
+
+        if current_url and current_url != "about:blank":
+            try:
+                await self.page.goto(current_url, wait_until="domcontentloaded")
+            except Exception as e:
+                logger.error(f"Error navigating to {current_url}: {e}")
 
     def _apply_match_replace(self, item_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -153,72 +349,39 @@ class BrowserManager:
         item_type: 'Request header', 'Response header', 'Request body', 'Response body', 'Request first line', 'Response first line'
         data: depends on item_type
         """
-        import re
-        
-        rules = [r for r in self.match_replace_rules if r.enabled and r.item == item_type]
+        rules = self._rules_by_item.get(item_type)
         if not rules:
             return data
 
         if item_type in ['Request header', 'Response header']:
             # data is a dict of headers
-            headers = data.copy()
-            for rule in rules:
-                # In Burp, header matching can match the entire header line or just the value.
-                # Here we'll treat it as: if match is 'HeaderName: .*', replace it.
-                # Or if match is just 'HeaderName', replace the whole line?
-                # Actually, Burp's 'Request header' rule usually matches the header string 'Name: Value'.
-                
-                # Simple implementation: iterate over all headers, join as string, replace, split back.
-                # This is most flexible for replacing parts of values or deleting headers.
-                header_lines = [f"{k}: {v}" for k, v in headers.items()]
-                new_lines = []
-                for line in header_lines:
-                    new_line = line
-                    if rule.isRegex:
-                        try:
-                            new_line = re.sub(rule.match, rule.replace, line)
-                        except: pass
-                    else:
-                        new_line = line.replace(rule.match, rule.replace)
-                    
-                    if new_line: # If empty after replace, effectively deletes the header
-                         new_lines.append(new_line)
-                
-                # Re-parse headers
-                new_headers = {}
-                for line in new_lines:
-                    if ': ' in line:
-                        k, v = line.split(': ', 1)
-                        new_headers[k] = v
-                    elif ':' in line:
-                        k, v = line.split(':', 1)
-                        new_headers[k] = v
-                headers = new_headers
+            # In Burp, header matching can match the entire header line or just the value.
+            # Burp's 'Request header' rule usually matches the header string 'Name: Value',
+            # so every rule sees 'Name: Value' lines, which lets it replace parts of values
+            # or delete headers. Each header goes through all rules in a single pass; rules
+            # that can't span the separator skip the line and work on the name/value directly.
+            header_rules = self._header_rules[item_type]
+            headers = {}
+            for k, v in data.items():
+                rewritten = _rewrite_header(header_rules, k, v)
+                if rewritten is not None:
+                    headers[rewritten[0]] = rewritten[1]
             return headers
 
         elif item_type in ['Request body', 'Response body']:
-            # data is a string
+            # data is a string, or bytes when every rule for it is literal
             body = data
             if body is None: return body
-            for rule in rules:
-                if rule.isRegex:
-                    try:
-                        body = re.sub(rule.match, rule.replace, body)
-                    except: pass
-                else:
-                    body = body.replace(rule.match, rule.replace)
-            return body
+            if isinstance(body, bytes):
+                for match_b, replace_b in self._byte_rules[item_type]:
+                    body = body.replace(match_b, replace_b)
+                return body
+            return _run_rules(rules, body)
 
         elif item_type == 'Request first line':
             # data: {method, url}
             line = f"{data['method']} {data['url']} HTTP/1.1" # Simplified line
-            for rule in rules:
-                if rule.isRegex:
-                    try:
-                        line = re.sub(rule.match, rule.replace, line)
-                    except: pass
-                else:
-                    line = line.replace(rule.match, rule.replace)
+            line = _run_rules(rules, line)
             
             # Try to reconstruct method/url
             parts = line.split(' ')
@@ -229,13 +392,7 @@ class BrowserManager:
         elif item_type == 'Response first line':
             # data: {status}
             line = f"HTTP/1.1 {data['status']}"
-            for rule in rules:
-                if rule.isRegex:
-                    try:
-                        line = re.sub(rule.match, rule.replace, line)
-                    except: pass
-                else:
-                    line = line.replace(rule.match, rule.replace)
+            line = _run_rules(rules, line)
             
             # Try to reconstruct status
             parts = line.split(' ')
@@ -250,25 +407,33 @@ class BrowserManager:
     async def _route_handler(self, route):
         """Handle route interception - can pause for user decision on request AND response"""
         request = route.request
+        self._requests_since_recycle += 1
+        self._routes_in_flight += 1
         
         try:
             # Prepare Request Data
             headers = await request.all_headers()
             post_data = request.post_data
             
-            # --- Apply Match & Replace (Request) ---
-            # 1. First Line
-            line_data = self._apply_match_replace('Request first line', {"method": request.method, "url": request.url})
-            final_method = line_data.get("method", request.method)
-            final_url = line_data.get("url", request.url)
-            
-            # 2. Headers
-            final_headers = self._apply_match_replace('Request header', headers)
+            final_method = request.method
+            final_url = request.url
+            final_headers = headers
+            final_body = post_data
             
-            # 3. Body
-            final_body = self._apply_match_replace('Request body', post_data)
+            # --- Apply Match & Replace (Request) ---
+            if self._has_any_rules:
+                # 1. First Line
+                line_data = self._apply_match_replace('Request first line', {"method": final_method, "url": final_url})
+                final_method = line_data.get("method", final_method)
+                final_url = line_data.get("url", final_url)
+                
+                # 2. Headers
+                final_headers = self._apply_match_replace('Request header', final_headers)
+                
+                # 3. Body
+                final_body = self._apply_match_replace('Request body', final_body)
             
-            req_id = str(uuid.uuid4())
+            req_id = self._next_id()
             req_data = {
                 "id": req_id,
                 "type": "request",
@@ -288,22 +453,27 @@ class BrowserManager:
             # And Header Overrides (to support forbidden headers like Host/Cookie/UA in Repeater)
             is_repeater_bypass = False
             override_headers = {}
+            control_keys = []
             
-            for k, v in list(final_headers.items()): # list to avoid runtime change issues
+            for k, v in final_headers.items():
                 kl = k.lower()
+                if kl not in _CONTROL_HEADERS:
+                    continue
+                control_keys.append(k)
                 if kl == "x-waf-bypass-repeater":
                     is_repeater_bypass = True
-                elif kl == "x-antigravity-override":
+                else:
                     try:
-                        override_headers = json.loads(v)
+                        override_headers = _json_loads(v)
                     except:
                         pass
             
             # Remove internal headers and Apply Overrides
-            if is_repeater_bypass or override_headers:
+            if control_keys:
                 # Start with original headers (already modified by match/replace), remove internal ones
-                final_headers = {k: v for k, v in final_headers.items() 
-                                 if k.lower() not in ["x-waf-bypass-repeater", "x-antigravity-override"]}
+                final_headers = dict(final_headers)
+                for k in control_keys:
+                    del final_headers[k]
                 # Apply overrides (Host, Cookie, UA, etc.)
                 if override_headers:
                     final_headers.update(override_headers)
@@ -349,7 +519,7 @@ class BrowserManager:
             if is_repeater_bypass:
                 try:
                     # Clean headers for continue_
-                    continue_headers = {k: v for k, v in final_headers.items() if k.lower() not in ["host", "content-length"]}
+                    continue_headers = {k: v for k, v in final_headers.items() if k.lower() not in _CONTINUE_STRIPPED_HEADERS}
                     
                     await route.continue_(
                         method=final_method,
@@ -375,27 +545,46 @@ class BrowserManager:
                 return
 
             # 3. Capture/Intercept Response
-            res_id = str(uuid.uuid4())
+            res_id = self._next_id()
             
             # Get body
-            try:
-                res_body = await response.text()
-            except:
-                res_body = "<binary data>"
+            # Skip fetching binary assets nobody can view or rewrite as text
+            body_bytes = None
+            if (request.resource_type not in _BINARY_RESOURCE_TYPES
+                    or self.intercept_responses or self._has_body_rules
+                    or response.headers.get("content-type", "").lower().startswith(_TEXT_CONTENT_TYPES)):
+                try:
+                    body_bytes = await response.body()
+                except:
+                    pass
                 
             res_headers = response.headers
             res_status = response.status
+            fulfill_body = None # Only set when the body was rewritten
             
             # --- Apply Match & Replace (Response) ---
-            # 1. First Line
-            line_data = self._apply_match_replace('Response first line', {"status": res_status})
-            res_status = line_data.get("status", res_status)
-            
-            # 2. Headers
-            res_headers = self._apply_match_replace('Response header', res_headers)
+            if self._has_any_rules:
+                # 1. First Line
+                line_data = self._apply_match_replace('Response first line', {"status": res_status})
+                res_status = line_data.get("status", res_status)
+                
+                # 2. Headers
+                res_headers = self._apply_match_replace('Response header', res_headers)
+                
+                # 3. Body (literal-only rules rewrite the raw bytes, without decoding)
+                if body_bytes is not None and 'Response body' in self._byte_rules:
+                    new_bytes = self._apply_match_replace('Response body', body_bytes)
+                    if new_bytes is not body_bytes:
+                        body_bytes = fulfill_body = new_bytes
             
-            # 3. Body
-            res_body = self._apply_match_replace('Response body', res_body)
+            res_body = _decode_body(body_bytes)
+            if res_body is None:
+                res_body = "<binary data>"
+            elif self._has_body_rules and 'Response body' not in self._byte_rules:
+                # Regex rules need the decoded text
+                new_body = self._apply_match_replace('Response body', res_body)
+                if new_body is not res_body:
+                    res_body = fulfill_body = new_body
             
             res_data = {
                 "id": res_id,
@@ -437,7 +626,9 @@ class BrowserManager:
                 modified = item.get("modified", {}) if item else {}
                 res_status = modified.get("status", res_status)
                 res_headers = modified.get("headers", res_headers)
-                res_body = modified.get("body", res_body)
+                new_body = modified.get("body", res_body)
+                if new_body != res_body:
+                    res_body = fulfill_body = new_body
                 
                 if res_id in self.pending_items:
                     del self.pending_items[res_id]
@@ -447,15 +638,13 @@ class BrowserManager:
                     await self.on_request_captured(res_data)
 
             # 4. Fulfill the route
-            # If body is modified, we need to pass string/bytes. If not, we can pass response?
-            # fulfill(response=response) uses original.
-            # We want to support modification.
-            
-            await route.fulfill(
-                status=res_status,
-                headers=res_headers,
-                body=res_body
-            )
+            # fulfill(response=response) serves the fetched body straight from Playwright,
+            # so the body is only sent back over the wire when a rule or the user changed it.
+            # (This also keeps binary assets intact instead of replacing them with the placeholder.)
+            fulfill_args = {"response": response, "status": res_status, "headers": res_headers}
+            if fulfill_body is not None:
+                fulfill_args["body"] = fulfill_body
+            await route.fulfill(**fulfill_args)
 
         except Exception as e:
             logger.error(f"Error in route handler: {e}")
@@ -463,6 +652,37 @@ class BrowserManager:
                 await route.continue_() # Fallback
             except:
                 pass
+        finally:
+            self._routes_in_flight -= 1
+            if self._should_recycle_context():
+                self._recycle_task = asyncio.create_task(self._recycle_context())
+
+    def set_match_replace_rules(self, rules: List[Any]):
+        """Replace the match/replace rules, compiling and bucketing them by item type"""
+        self.match_replace_rules = list(rules)
+        rules_by_item: Dict[str, List[Tuple[Any, Optional[Pattern]]]] = {}
+        for rule in self.match_replace_rules:
+            if not rule.enabled:
+                continue
+            try:
+                pattern = _compile_rule(rule)
+            except re.error as e:
+                logger.warning(f"Skipping invalid match/replace regex {rule.match!r}: {e}")
+                continue
+            rules_by_item.setdefault(rule.item, []).append((rule, pattern))
+        self._rules_by_item = rules_by_item
+        self._has_any_rules = bool(rules_by_item)
+        self._has_body_rules = 'Response body' in rules_by_item
+        self._header_rules = {
+            item_type: [(rule, pattern, _is_part_local(rule, pattern)) for rule, pattern in rules_by_item[item_type]]
+            for item_type in ['Request header', 'Response header'] if item_type in rules_by_item
+        }
+        # Literal body rules can run on raw bytes (UTF-8 matching is byte-exact),
+        # but an empty match would insert between the bytes of a multi-byte character
+        self._byte_rules = {}
+        rules = rules_by_item.get('Response body')
+        if rules and all(pattern is None and rule.match for rule, pattern in rules):
+            self._byte_rules['Response body'] = [(rule.match.encode(), rule.replace.encode()) for rule, _ in rules]
 
     def set_intercept_requests(self, enabled: bool):
         """Toggle request interception"""
@@ -528,16 +748,16 @@ class BrowserManager:
         # Strategy: Use page.evaluate to run window.fetch
         # This is the ULTIMATE WAF bypass because it IS the browser's JS engine sending it.
         
+        self._replays_in_flight += 1
         try:
             # 0. Navigate to the target domain first!
             # WAFs like Incapsula check if window.location matches the request domain.
             # Running from about:blank triggers immediate blocks.
-            from urllib.parse import urlparse
-            target_url_obj = urlparse(url)
-            target_origin = f"{target_url_obj.scheme}://{target_url_obj.netloc}"
+            target_origin = _origin_of(url)
             
             # Only navigate if we are not already there (to save time)
-            if not self.page.url.startswith(target_origin):
+            # page.url is the main frame URL, kept locally by Playwright - no round-trip
+            if _origin_of(self.page.url) != target_origin:
                 logger.info(f"Navigating to {target_origin} to establish correct Origin/Context...")
                 try:
                     # We just need to establish the Origin. 
@@ -549,14 +769,15 @@ class BrowserManager:
             # Prepare Header Overrides (Ultimate Bypass)
             # Browser fetch API blocks many headers (unsafe). We pack them into a custom header
             # which _route_handler will unpack and apply to the final request.
-            import json
+            # (stdlib json.dumps on purpose: it escapes non-ASCII, and header values must stay ASCII)
             headers_json = json.dumps(headers)
 
             # Filter for SAFE headers only for the JS fetch call
-            # This list includes headers typically forbidden in window.fetch
-            forbidden = ["host", "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade", "cookie", "user-agent", "referer", "origin", "content-length", "date", "expect"]
-            
-            safe_headers = {k: v for k, v in headers.items() if k.lower() not in forbidden and not k.lower().startswith("sec-")}
+            safe_headers = {}
+            for k, v in headers.items():
+                kl = k.lower()
+                if kl not in _FORBIDDEN_FETCH_HEADERS and not kl.startswith("sec-"):
+                    safe_headers[k] = v
 
             # Inject Control Headers
             safe_headers["X-WAF-Bypass-Repeater"] = "1"
@@ -569,10 +790,14 @@ class BrowserManager:
             # This avoids "No resource with given identifier" Protocol Errors from CDP
             # because we are reading the body inside the JS VM immediately.
             js_script = """
-            async ({url, method, headers, body}) => {
+            async ({url, method, headers, body, timeoutMs}) => {
+                // Abort inside the browser too, so a hung origin doesn't leave the fetch pending in the page
+                const controller = new AbortController();
+                const timer = setTimeout(() => controller.abort(), timeoutMs);
                 const options = {
                     method: method,
                     headers: headers,
+                    signal: controller.signal,
                 };
                 if (method !== 'GET' && method !== 'HEAD') {
                     options.body = body;
@@ -594,20 +819,29 @@ class BrowserManager:
                         body: text
                     };
                 } catch (e) {
+                    if (e.name === 'AbortError') {
+                        return { timeout: true };
+                    }
                     return { error: e.toString() };
+                } finally {
+                    clearTimeout(timer);
                 }
             }
             """
             
             try:
-                # We don't need expect_response anymore, evaluate will wait for the fetch
-                result = await self.page.evaluate(js_script, {
+                # We don't need expect_response anymore, evaluate will wait for the fetch.
+                # The in-page abort normally fires first; wait_for is the backstop if the page itself hangs.
+                result = await asyncio.wait_for(self.page.evaluate(js_script, {
                     "url": url,
                     "method": method,
                     "headers": safe_headers,
-                    "body": body
-                })
+                    "body": body,
+                    "timeoutMs": REPLAY_TIMEOUT * 1000
+                }), timeout=REPLAY_TIMEOUT + 5)
                 
+                if "timeout" in result:
+                    raise asyncio.TimeoutError()
                 if "error" in result:
                      return {"error": f"JS Fetch Error: {result['error']}"}
 
@@ -618,11 +852,10 @@ class BrowserManager:
                 }
             except asyncio.TimeoutError:
                 logger.error(f"Replay timed out for {url}")
-                return {"error": "Request timed out (30s)."}
-            except asyncio.TimeoutError:
-                logger.error(f"Replay timed out for {url}")
-                return {"error": "Request timed out (30s). The server took too long to respond."}
+                return {"error": f"Request timed out ({REPLAY_TIMEOUT}s). The server took too long to respond."}
 
         except Exception as e:
             logger.error(f"Replay failed: {e}")
             return {"error": str(e)}
+        finally:
+            self._replays_in_flight -= 1
@@ -1,22 +1,36 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ValidationError
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from typing import Awaitable, Callable, Dict, List, Optional
 import asyncio
 import json
 import logging
 import os
 import sys
 from browser import BrowserManager
-from project_manager import ProjectManager, Project, CapturedRequest, ExclusionRule
+from project_manager import ProjectManager, Project, CapturedRequest, ExclusionRule, MatchReplaceRule
+
+try:
+    import orjson  # Optional, faster JSON encoding
+except ImportError:
+    orjson = None
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The browser check runs alongside server startup instead of blocking the import of browser.py
+    browser_check = asyncio.create_task(browser_manager.ensure_browser())
+    yield
+    browser_check.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,14 +44,53 @@ app.add_middleware(
 project_manager = ProjectManager()
 
 # Global Browser Manager
-active_connections = []
+# Connected websockets, each with its own bounded outgoing queue so a slow client only backs up itself.
+# Messages are never dropped silently: a client that falls WS_QUEUE_SIZE messages behind is disconnected,
+# and gets the still-pending intercept items again when it reconnects.
+active_connections: Dict[WebSocket, asyncio.Queue] = {}
+WS_QUEUE_SIZE = 4096
+WS_CLOSE_TRY_AGAIN_LATER = 1013
 
-async def broadcast_message(message: dict):
-    for connection in active_connections:
+async def websocket_writer(websocket: WebSocket, queue: asyncio.Queue):
+    """Drain one connection's queue of pre-encoded messages onto its socket (its only writer)"""
+    while True:
+        text = await queue.get()
         try:
-            await connection.send_json(message)
+            if text is None: # Overflow, see enqueue_message
+                await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER)
+                return
+            await websocket.send_text(text)
         except Exception as e:
             logger.error(f"Error sending to websocket: {e}")
+            return
+
+def enqueue_message(websocket: WebSocket, queue: asyncio.Queue, text: str):
+    try:
+        queue.put_nowait(text)
+    except asyncio.QueueFull:
+        logger.warning("Websocket client fell too far behind, disconnecting it")
+        # Stop feeding it, free what it never read, and have its writer close the socket
+        active_connections.pop(websocket, None)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+def encode_message(message: dict) -> str:
+    if orjson:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+def send_message(websocket: WebSocket, message: dict):
+    """Queue a message for one connection, behind anything already queued for it"""
+    queue = active_connections.get(websocket)
+    if queue is not None:
+        enqueue_message(websocket, queue, encode_message(message))
+
+async def broadcast_message(message: dict):
+    # Encode once (capture events can carry whole bodies); every queue shares the same string
+    text = encode_message(message)
+    for websocket, queue in list(active_connections.items()):
+        enqueue_message(websocket, queue, text)
 
 async def on_browser_event(data: dict):
     await broadcast_message({"type": "capture", "data": data})
@@ -45,11 +98,13 @@ async def on_browser_event(data: dict):
 browser_manager = BrowserManager(on_request_captured=on_browser_event)
 
 # --- Project API Endpoints ---
+# Project files can get large, so their blocking reads/writes run in a worker thread
+# instead of stalling the event loop (and the websocket broadcasts) for the duration
 
 @app.get("/api/projects")
 async def list_projects():
     """List all saved projects"""
-    return project_manager.list_projects()
+    return await asyncio.to_thread(project_manager.list_projects)
 
 class CreateProjectRequest(BaseModel):
     name: str
@@ -57,54 +112,88 @@ class CreateProjectRequest(BaseModel):
 @app.post("/api/projects")
 async def create_project(req: CreateProjectRequest):
     """Create a new project"""
-    project = project_manager.create_project(req.name)
-    return {"success": True, "project": project.dict()}
+    project = await asyncio.to_thread(project_manager.create_project, req.name)
+    return {"success": True, "project": project.model_dump()}
 
 @app.get("/api/projects/{name}")
 async def get_project(name: str):
     """Load a project by name"""
-    project = project_manager.load_project(name)
+    project = await asyncio.to_thread(project_manager.load_project, name)
     if project:
         # Sync rules to browser manager
-        browser_manager.match_replace_rules = project.matchReplaceRules
-        return project.dict()
+        browser_manager.set_match_replace_rules(project.matchReplaceRules)
+        return project.model_dump()
     return {"error": "Project not found"}
 
 class SaveProjectRequest(BaseModel):
     name: str
     targetUrl: str = "https://example.com"
-    requests: List[dict] = []
-    exclusionRules: List[dict] = []
+    requests: List[CapturedRequest] = []
+    exclusionRules: List[ExclusionRule] = []
     historyFilter: str = ""
     hideStatic: bool = False
     repeaterTabs: List[dict] = []
-    matchReplaceRules: List[dict] = []
+    matchReplaceRules: List[MatchReplaceRule] = []
+
+# save_project validates its raw body itself, so FastAPI doesn't see a body model to document;
+# the schema is registered with the OpenAPI components below and referenced from the route
+_SAVE_PROJECT_SCHEMAS = SaveProjectRequest.model_json_schema(ref_template="#/components/schemas/{model}")
+_SAVE_PROJECT_SCHEMAS = {
+    **_SAVE_PROJECT_SCHEMAS.pop("$defs", {}),
+    SaveProjectRequest.__name__: _SAVE_PROJECT_SCHEMAS,
+}
 
-@app.put("/api/projects/{name}")
-async def save_project(name: str, req: SaveProjectRequest):
+@app.put("/api/projects/{name}", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": {"$ref": f"#/components/schemas/{SaveProjectRequest.__name__}"}}},
+    },
+})
+async def save_project(name: str, request: Request):
     """Save/update a project"""
-    existing = project_manager.load_project(name)
+    # The payload carries the whole capture history, so parse and validate it
+    # in one pass instead of letting FastAPI decode it to a dict first
+    body = await request.body()
+    try:
+        req = SaveProjectRequest.model_validate_json(body)
+    except ValidationError as e:
+        # Same shape as FastAPI's own body errors: locations are rooted at "body"
+        errors = [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        raise RequestValidationError(errors, body=body)
+    
+    existing = await asyncio.to_thread(project_manager.load_project, name)
     if not existing:
-        existing = project_manager.create_project(name)
+        existing = await asyncio.to_thread(project_manager.create_project, name)
     
     existing.targetUrl = req.targetUrl
-    existing.requests = [CapturedRequest(**r) for r in req.requests]
-    existing.exclusionRules = [ExclusionRule(**r) for r in req.exclusionRules]
+    existing.requests = req.requests
+    existing.exclusionRules = req.exclusionRules
     existing.historyFilter = req.historyFilter
     existing.hideStatic = req.hideStatic
     existing.repeaterTabs = req.repeaterTabs
-    existing.matchReplaceRules = [MatchReplaceRule(**r) for r in req.matchReplaceRules]
+    existing.matchReplaceRules = req.matchReplaceRules
     
     # Sync rules to browser manager
-    browser_manager.match_replace_rules = existing.matchReplaceRules
+    browser_manager.set_match_replace_rules(existing.matchReplaceRules)
     
-    success = project_manager.save_project(existing)
+    success = await asyncio.to_thread(project_manager.save_project, existing)
     return {"success": success}
 
+def custom_openapi():
+    """FastAPI's generated schema, plus the components of the bodies validated by hand"""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        components = schema.setdefault("components", {}).setdefault("schemas", {})
+        for model_name, model_schema in _SAVE_PROJECT_SCHEMAS.items():
+            components.setdefault(model_name, model_schema)
+    return app.openapi_schema
+
+app.openapi = custom_openapi
+
 @app.delete("/api/projects/{name}")
 async def delete_project(name: str):
     """Delete a project"""
-    success = project_manager.delete_project(name)
+    success = await asyncio.to_thread(project_manager.delete_project, name)
     return {"success": success}
 
 # --- Browser Control ---
@@ -122,78 +211,95 @@ async def stop_browser():
     await browser_manager.stop()
     return {"status": "stopped"}
 
+# --- WebSocket command handlers ---
+async def _handle_replay(websocket: WebSocket, data: dict):
+    req_data = data.get("request")
+    if req_data:
+        result = await browser_manager.replay_request(req_data)
+        send_message(websocket, {
+            "type": "replay_response",
+            "original_id": req_data.get("id"),
+            "tab_id": data.get("tabId"),
+            "response": result
+        })
+
+async def _handle_start(websocket: WebSocket, data: dict):
+    url = data.get("url")
+    if url:
+        asyncio.create_task(browser_manager.start(url))
+
+async def _handle_stop(websocket: WebSocket, data: dict):
+    await browser_manager.stop()
+
+# Intercept control commands
+async def _handle_intercept_requests(websocket: WebSocket, data: dict):
+    enabled = data.get("enabled", False)
+    browser_manager.set_intercept_requests(enabled)
+    send_message(websocket, {
+        "type": "intercept_status",
+        "intercept_requests": enabled,
+        "intercept_responses": browser_manager.intercept_responses
+    })
+
+async def _handle_intercept_responses(websocket: WebSocket, data: dict):
+    enabled = data.get("enabled", False)
+    browser_manager.set_intercept_responses(enabled)
+    send_message(websocket, {
+        "type": "intercept_status",
+        "intercept_requests": browser_manager.intercept_requests,
+        "intercept_responses": enabled
+    })
+
+async def _handle_forward(websocket: WebSocket, data: dict):
+    item_id = data.get("id")
+    modified = data.get("modified")
+    success = browser_manager.forward_item(item_id, modified)
+    send_message(websocket, {
+        "type": "forward_result",
+        "id": item_id,
+        "success": success
+    })
+
+async def _handle_drop(websocket: WebSocket, data: dict):
+    item_id = data.get("id")
+    success = browser_manager.drop_item(item_id)
+    send_message(websocket, {
+        "type": "drop_result",
+        "id": item_id,
+        "success": success
+    })
+
+COMMAND_HANDLERS: Dict[str, Callable[[WebSocket, dict], Awaitable[None]]] = {
+    "replay": _handle_replay,
+    "start": _handle_start,
+    "stop": _handle_stop,
+    "intercept_requests": _handle_intercept_requests,
+    "intercept_responses": _handle_intercept_responses,
+    "forward": _handle_forward,
+    "drop": _handle_drop,
+}
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    active_connections.append(websocket)
+    queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+    active_connections[websocket] = queue
+    writer = asyncio.create_task(websocket_writer(websocket, queue))
+    # Intercepted items still waiting for a forward/drop (e.g. after a reconnect)
+    for item in list(browser_manager.pending_items.values()):
+        send_message(websocket, {"type": "capture", "data": item["data"]})
     try:
-        while True:
-            data = await websocket.receive_json()
-            cmd = data.get("command")
-            
-            if cmd == "replay":
-                req_data = data.get("request")
-                if req_data:
-                    result = await browser_manager.replay_request(req_data)
-                    await websocket.send_json({
-                        "type": "replay_response",
-                        "original_id": req_data.get("id"),
-                        "tab_id": data.get("tabId"),
-                        "response": result
-                    })
-                    
-            elif cmd == "start":
-                url = data.get("url")
-                if url:
-                    asyncio.create_task(browser_manager.start(url))
-
-            elif cmd == "stop":
-                await browser_manager.stop()
-            
-            # Intercept control commands
-            elif cmd == "intercept_requests":
-                enabled = data.get("enabled", False)
-                browser_manager.set_intercept_requests(enabled)
-                await websocket.send_json({
-                    "type": "intercept_status",
-                    "intercept_requests": enabled,
-                    "intercept_responses": browser_manager.intercept_responses
-                })
-            
-            elif cmd == "intercept_responses":
-                enabled = data.get("enabled", False)
-                browser_manager.set_intercept_responses(enabled)
-                await websocket.send_json({
-                    "type": "intercept_status",
-                    "intercept_requests": browser_manager.intercept_requests,
-                    "intercept_responses": enabled
-                })
-            
-            elif cmd == "forward":
-                item_id = data.get("id")
-                modified = data.get("modified")
-                success = browser_manager.forward_item(item_id, modified)
-                await websocket.send_json({
-                    "type": "forward_result",
-                    "id": item_id,
-                    "success": success
-                })
-            
-            elif cmd == "drop":
-                item_id = data.get("id")
-                success = browser_manager.drop_item(item_id)
-                await websocket.send_json({
-                    "type": "drop_result",
-                    "id": item_id,
-                    "success": success
-                })
-
-    except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        # Ends cleanly when the client disconnects
+        async for data in websocket.iter_json():
+            handler = COMMAND_HANDLERS.get(data.get("command"))
+            if handler:
+                await handler(websocket, data)
+
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        if websocket in active_connections:
-            active_connections.remove(websocket)
+    finally:
+        active_connections.pop(websocket, None)
+        writer.cancel()
 
 # --- Static File Serving (for bundled exe) ---
 # Check if running from bundled exe
@@ -203,7 +309,7 @@ def get_static_dir():
     static_in_backend = os.path.join(base, 'static')
     
     if os.path.exists(os.path.join(static_in_backend, 'index.html')):
-        print(f"[DEBUG] Serving from backend/static: {static_in_backend}")
+        logger.debug("Serving from backend/static: %s", static_in_backend)
         return static_in_backend
         
     if getattr(sys, 'frozen', False):
@@ -212,24 +318,39 @@ def get_static_dir():
     else:
         # Fallback to frontend/dist for dev
         path = os.path.normpath(os.path.join(base, '..', 'frontend', 'dist'))
-        print(f"[DEBUG] Falling back to frontend/dist: {path}")
+        logger.debug("Falling back to frontend/dist: %s", path)
         return path
 
+class SPAStaticFiles(StaticFiles):
+    """Static files that fall back to index.html for unknown paths (client-side routes)"""
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.index_path = os.path.join(directory, "index.html")
+        # Top-level names in the build output; anything else is a client route
+        self.entries = frozenset(os.listdir(directory))
+
+    async def get_response(self, path: str, scope):
+        if scope["method"] not in ("GET", "HEAD") or path.split(os.sep, 1)[0] in self.entries:
+            try:
+                return await super().get_response(path, scope)
+            except StarletteHTTPException as e:
+                if e.status_code != 404:
+                    raise
+        return self.file_response(self.index_path, os.stat(self.index_path), scope)
+
+class ImmutableStaticFiles(StaticFiles):
+    """Static files with content-hashed names (Vite build output), cacheable forever"""
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
 static_dir = get_static_dir()
-print(f"[DEBUG] Static dir exists: {os.path.exists(static_dir)}")
+logger.debug("Static dir: %s", static_dir)
 if os.path.exists(static_dir):
-    app.mount("/assets", StaticFiles(directory=os.path.join(static_dir, "assets")), name="assets")
-    
-    @app.get("/")
-    async def serve_index():
-        return FileResponse(os.path.join(static_dir, "index.html"))
-    
-    @app.get("/{path:path}")
-    async def serve_static(path: str):
-        file_path = os.path.join(static_dir, path)
-        if os.path.exists(file_path):
-            return FileResponse(file_path)
-        return FileResponse(os.path.join(static_dir, "index.html"))
+    # Mounted last so the API and websocket routes above take precedence
+    app.mount("/assets", ImmutableStaticFiles(directory=os.path.join(static_dir, "assets")), name="assets")
+    app.mount("/", SPAStaticFiles(directory=static_dir, html=True), name="spa")
 
 if __name__ == "__main__":
     import uvicorn
@@ -251,4 +372,6 @@ if __name__ == "__main__":
     
     threading.Thread(target=open_browser, daemon=True).start()
     
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # "auto" picks uvloop (not available on Windows) and the httptools C parser when installed,
+    # falling back to asyncio and h11 otherwise
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto")
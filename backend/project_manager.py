@@ -1,19 +1,48 @@
+import functools
+import logging
 import os
-import json
+import re
+import time
+import uuid
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional, Tuple
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
 # Project storage location
 PROJECTS_DIR = "D:/ChameleonProjects"
 
+# Characters not allowed in project filenames (\w is Unicode-aware: letters/digits of any script, plus '_')
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^\w \-]")
+
+# On Windows os.replace fails while another thread (e.g. a load or listing) has the target open
+_REPLACE_ATTEMPTS = 10
+_REPLACE_RETRY_DELAY = 0.05
+
+def _replace_file(src: str, dst: str):
+    """os.replace, retried briefly while the destination is held open"""
+    for attempt in range(_REPLACE_ATTEMPTS):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == _REPLACE_ATTEMPTS - 1:
+                raise
+            time.sleep(_REPLACE_RETRY_DELAY)
+
+@functools.lru_cache(maxsize=256)
+def _project_filename(name: str) -> str:
+    """Sanitize a project name for the filesystem"""
+    return f"{_UNSAFE_FILENAME_CHARS.sub('', name).strip()}.json"
+
 class ExclusionRule(BaseModel):
-    type: str  # 'domain', 'url', 'regex'
+    type: Literal['domain', 'url', 'regex']
     value: str
 
 class MatchReplaceRule(BaseModel):
     enabled: bool = True
-    item: str  # 'Request header', 'Response header', 'Request body', 'Response body', 'Request first line', 'Response first line'
+    item: Literal['Request header', 'Response header', 'Request body', 'Response body', 'Request first line', 'Response first line']
     match: str
     replace: str
     isRegex: bool = False
@@ -41,8 +70,21 @@ class Project(BaseModel):
     repeaterTabs: List[dict] = []
     matchReplaceRules: List[MatchReplaceRule] = []
 
+class _CountedItem(BaseModel):
+    """Fieldless stand-in: unknown keys are ignored, so an item's contents never become Python objects"""
+
+class ProjectSummary(BaseModel):
+    """Top-level fields of a project file shown in the project list"""
+    name: Optional[str] = None
+    created: str = ""
+    lastModified: str = ""
+    targetUrl: str = ""
+    requests: List[_CountedItem] = []  # Only counted
+
 class ProjectManager:
     def __init__(self):
+        # filename -> ((mtime_ns, size), summary); files are only re-parsed when they change
+        self._summary_cache: Dict[str, Tuple[Tuple[int, int], dict]] = {}
         self.ensure_projects_dir()
     
     def ensure_projects_dir(self):
@@ -52,29 +94,40 @@ class ProjectManager:
     
     def get_project_path(self, name: str) -> str:
         """Get the file path for a project"""
-        # Sanitize name for filesystem
-        safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip()
-        return os.path.join(PROJECTS_DIR, f"{safe_name}.json")
+        return os.path.join(PROJECTS_DIR, _project_filename(name))
     
     def list_projects(self) -> List[dict]:
         """List all saved projects"""
         self.ensure_projects_dir()
         projects = []
-        for filename in os.listdir(PROJECTS_DIR):
-            if filename.endswith('.json'):
-                filepath = os.path.join(PROJECTS_DIR, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        projects.append({
-                            "name": data.get("name", filename[:-5]),
-                            "created": data.get("created", ""),
-                            "lastModified": data.get("lastModified", ""),
-                            "targetUrl": data.get("targetUrl", ""),
-                            "requestCount": len(data.get("requests", []))
-                        })
-                except Exception:
-                    pass
+        cache = {}
+        # DirEntry carries the path, and on Windows its stat() comes from the directory listing itself
+        with os.scandir(PROJECTS_DIR) as entries:
+            json_entries = [e for e in entries if e.name.endswith('.json')]
+        for entry in json_entries:
+            filename = entry.name
+            try:
+                st = entry.stat()
+                key = (st.st_mtime_ns, st.st_size)
+                cached = self._summary_cache.get(filename)
+                if cached and cached[0] == key:
+                    project = cached[1]
+                else:
+                    with open(entry.path, 'rb') as f:
+                        summary = ProjectSummary.model_validate_json(f.read())
+                    project = {
+                        "name": summary.name or filename[:-5],
+                        "created": summary.created,
+                        "lastModified": summary.lastModified,
+                        "targetUrl": summary.targetUrl,
+                        "requestCount": len(summary.requests)
+                    }
+                cache[filename] = (key, project)
+                projects.append(project)
+            except Exception:
+                pass
+        # Rebuilding the cache from this listing also forgets files deleted behind our back
+        self._summary_cache = cache
         return sorted(projects, key=lambda x: x.get("lastModified", ""), reverse=True)
     
     def create_project(self, name: str) -> Project:
@@ -94,29 +147,43 @@ class ProjectManager:
         if not os.path.exists(filepath):
             return None
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return Project(**data)
-        except Exception as e:
-            print(f"Error loading project: {e}")
+            # Parse and validate in one pass, without building an intermediate dict
+            with open(filepath, 'rb') as f:
+                return Project.model_validate_json(f.read())
+        except Exception:
+            logger.exception("Error loading project %s", filepath)
             return None
     
     def save_project(self, project: Project) -> bool:
         """Save a project"""
+        filepath = self.get_project_path(project.name)
         try:
             self.ensure_projects_dir()
             project.lastModified = datetime.now().isoformat()
-            filepath = self.get_project_path(project.name)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(project.dict(), f, indent=2)
+            self._summary_cache.pop(os.path.basename(filepath), None)
+            # Serialize straight from the model, without building a dict first
+            data = project.model_dump_json().encode('utf-8')
+            # Write to a temp file in the same directory and swap it in, so a crash
+            # mid-write never leaves a torn project file behind
+            # (unique per save, since saves of the same project can overlap in worker threads)
+            tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+            f = open(tmp_path, 'xb')
+            try:
+                with f:
+                    f.write(data)
+                _replace_file(tmp_path, filepath)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
             return True
-        except Exception as e:
-            print(f"Error saving project: {e}")
+        except Exception:
+            logger.exception("Error saving project %s", filepath)
             return False
     
     def delete_project(self, name: str) -> bool:
         """Delete a project"""
         filepath = self.get_project_path(name)
+        self._summary_cache.pop(os.path.basename(filepath), None)
         if os.path.exists(filepath):
             os.remove(filepath)
             return True
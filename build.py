@@ -39,9 +39,9 @@ def main():
         shutil.rmtree(static_dest)
     shutil.copytree(os.path.join(FRONTEND_DIR, "dist"), static_dest)
 
-    # Step 3: Install PyInstaller if needed
+    # Step 3: Install PyInstaller (and the httptools HTTP parser bundled into the exe) if needed
     print("\n[3/4] Ensuring PyInstaller is installed...")
-    run(f"{sys.executable} -m pip install pyinstaller --quiet")
+    run(f"{sys.executable} -m pip install pyinstaller httptools --quiet")
 
     # Step 4: Run PyInstaller
     print("\n[4/4] Building executable...")